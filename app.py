@@ -1,30 +1,44 @@
 import streamlit as st
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 
-def calculate_ybus(n_nodes, branches):
+from ybus_kernel import ybus_kernel
+
+# Tamaño máximo de matriz que se muestra completa en pantalla
+MAX_DISPLAY_NODES = 50
+
+# Tamaño máximo para la vista densa de st.dataframe; por encima solo se ofrece la descarga
+MAX_DATAFRAME_NODES = 500
+
+# Límites de la caché de resultados: entradas por función y tiempo de vida
+CACHE_MAX_ENTRIES = 32
+CACHE_TTL = "1h"
+
+# Código de 2 bits por ubicación de la admitancia shunt: bit 0 = nodo inicial, bit 1 = nodo final
+LOC_MAP = {"Ninguno": 0, "Inicio": 1, "Final": 2, "Ambos": 3}
+
+def calculate_ybus(n_nodes, from_arr, to_arr, R, X, Ysh_imag, loc_arr):
     """
-    Matriz Ybus considerando impedancias y admitancias shunt en nodos extremos.
+    Matriz Ybus considerando impedancias y admitancias shunt en nodos extremos, en formato disperso CSR.
+    Las ramas llegan como arreglos por columna; loc_arr usa los códigos de LOC_MAP.
     """
-    Ybus = np.zeros((n_nodes, n_nodes), dtype=complex)
-    
-    for branch in branches:
-        i = branch['from'] - 1  # Ajuste de índice para Python (0-indexado)
-        j = branch['to'] - 1
-        Z = complex(branch['resistance'], branch['reactance'])  # Impedancia
-        Y = 1 / Z if Z != 0 else 0  # Admitancia (evita división por 0)
-        
-        Ybus[i, i] += Y
-        Ybus[j, j] += Y
-        Ybus[i, j] -= Y
-        Ybus[j, i] -= Y
-        
-        # Agregar admitancia shunt según ubicación seleccionada
-        if branch['y_shunt_loc'] == "Inicio" or branch['y_shunt_loc'] == "Ambos":
-            Ybus[i, i] += complex(0, branch['y_shunt_imag'])
-        if branch['y_shunt_loc'] == "Final" or branch['y_shunt_loc'] == "Ambos":
-            Ybus[j, j] += complex(0, branch['y_shunt_imag'])
-    
+    # Las ramas con impedancia nula no aportan a la parte serie; se descartan antes de ensamblar
+    active = (R != 0) | (X != 0)
+    Y = np.reciprocal(R[active] + 1j * X[active])  # Admitancia de todas las ramas activas a la vez
+    rows, cols, data = ybus_kernel(from_arr[active], to_arr[active], Y)
+
+    # Agregar admitancia shunt según ubicación seleccionada (también en ramas sin impedancia)
+    shunt_active = Ysh_imag != 0
+    add_i = shunt_active & (loc_arr & 1).astype(bool)
+    add_j = shunt_active & (loc_arr & 2).astype(bool)
+    rows = np.concatenate((rows, from_arr[add_i] - 1, to_arr[add_j] - 1))
+    cols = np.concatenate((cols, from_arr[add_i] - 1, to_arr[add_j] - 1))
+    data = np.concatenate((data, 1j * Ysh_imag[add_i], 1j * Ysh_imag[add_j]))
+
+    # Tripletas COO: las entradas repetidas se suman al convertir a CSR
+    Ybus = sp.coo_matrix((data, (rows, cols)), shape=(n_nodes, n_nodes), dtype=complex).tocsr()
+    Ybus.data += 0  # Normaliza -0.0 a 0.0, igual que al acumular sobre una matriz de ceros
     return Ybus
 
 def format_complex(z):
@@ -34,6 +48,51 @@ def format_complex(z):
     else:
         return f"{z.real:.5f} - {abs(z.imag):.5f}j"
 
+ZERO_STR = format_complex(0j)
+
+def format_matrix(Y):
+    """ Formatea toda una matriz compleja de una vez, con el mismo formato que format_complex. """
+    im = Y.imag
+    sign = np.where(im >= 0, ' + ', ' - ')
+    mag = np.char.mod('%.5f', np.abs(im))
+    real_s = np.char.mod('%.5f', Y.real)
+    return np.char.add(np.char.add(real_s, sign), np.char.add(mag, 'j'))
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def calculate_ybus_cached(n_nodes, branch_arrays):
+    """ Versión en caché de calculate_ybus; Streamlit hashea directamente los arreglos de las ramas. """
+    return calculate_ybus(n_nodes, *branch_arrays)
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def format_ybus_table(n_nodes, branch_arrays, _labels):
+    """
+    Tabla de la Ybus con cada elemento formateado, reutilizada entre ejecuciones con las mismas ramas.
+    Las etiquetas dependen solo de n_nodes, por eso no forman parte de la clave de caché.
+    """
+    # Solo se formatean los elementos no nulos; el resto comparte la misma cadena de cero
+    coo = calculate_ybus_cached(n_nodes, branch_arrays).tocoo()
+    formatted = np.full((n_nodes, n_nodes), ZERO_STR, dtype=object)
+    formatted[coo.row, coo.col] = format_matrix(coo.data)
+    return pd.DataFrame(formatted, index=_labels, columns=_labels)
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def ybus_entries_csv(n_nodes, branch_arrays, _labels):
+    """ CSV con los elementos no nulos de la Ybus (fila, columna, valor), de tamaño O(nnz). """
+    coo = calculate_ybus_cached(n_nodes, branch_arrays).tocoo()
+    df_entries = pd.DataFrame({
+        "Fila": _labels[coo.row],
+        "Columna": _labels[coo.col],
+        "Valor": format_matrix(coo.data),
+    })
+    return df_entries.to_csv(index=False).encode("utf-8")
+
+def node_labels(n_nodes):
+    """ Etiquetas "Nodo k" de filas y columnas, guardadas en la sesión por número de nodos. """
+    key = f"_labels_{n_nodes}"
+    if key not in st.session_state:
+        st.session_state[key] = np.char.mod('Nodo %d', np.arange(1, n_nodes + 1))
+    return st.session_state[key]
+
 def main():
     st.title("Cálculo de la Matriz Ybus con Impedancias")
     st.write("Este programa calcula la matriz Ybus de un sistema eléctrico de potencia basado en las impedancias de las líneas.")
@@ -43,7 +102,7 @@ def main():
     
     st.write("Ingrese los datos de cada línea:")
     with st.form("branch_form"):
-        branch_data = []
+        from_list, to_list, res_list, react_list, yshunt_list, loc_list = [], [], [], [], [], []
         
         for i in range(int(n_branches)):
             st.markdown(f"**Línea {i+1}**")
@@ -53,36 +112,48 @@ def main():
             resistance = col3.number_input("Resistencia (Ω)", step=0.00001, format="%.5f", key=f"res_{i}")
             reactance = col4.number_input("Reactancia (Ω)", step=0.00001, format="%.5f", key=f"react_{i}")
             y_shunt_imag = col5.number_input("Admitancia shunt (Imaginaria)", step=0.00001, format="%.5f", key=f"yshunt_imag_{i}")
-            y_shunt_loc = col6.selectbox("Ubicación Yshunt", ["Ninguno", "Inicio", "Final", "Ambos"], key=f"yshunt_loc_{i}")
+            y_shunt_loc = col6.selectbox("Ubicación Yshunt", list(LOC_MAP), key=f"yshunt_loc_{i}")
             
-            branch_data.append({
-                'from': from_node,
-                'to': to_node,
-                'resistance': resistance,
-                'reactance': reactance,
-                'y_shunt_imag': y_shunt_imag,
-                'y_shunt_loc': y_shunt_loc
-            })
+            from_list.append(from_node)
+            to_list.append(to_node)
+            res_list.append(resistance)
+            react_list.append(reactance)
+            yshunt_list.append(y_shunt_imag)
+            loc_list.append(LOC_MAP[y_shunt_loc])
         
         submitted = st.form_submit_button("Calcular Ybus")
-        if submitted:
-            valid = all(branch['from'] != branch['to'] for branch in branch_data)
-            if not valid:
-                st.error("El nodo inicial y final no pueden ser iguales en una línea.")
+    
+    if submitted:
+        # Datos de las ramas como arreglos por columna
+        from_arr = np.array(from_list, dtype=np.int32)
+        to_arr = np.array(to_list, dtype=np.int32)
+        branch_arrays = (
+            from_arr,
+            to_arr,
+            np.array(res_list, dtype=float),
+            np.array(react_list, dtype=float),
+            np.array(yshunt_list, dtype=float),
+            np.array(loc_list, dtype=np.int8),
+        )
+        if np.any(from_arr == to_arr):
+            st.error("El nodo inicial y final no pueden ser iguales en una línea.")
+        else:
+            st.write("La matriz Ybus calculada es:")
+            
+            labels = node_labels(int(n_nodes))
+            if n_nodes <= MAX_DISPLAY_NODES:
+                st.table(format_ybus_table(int(n_nodes), branch_arrays, labels))
+            elif n_nodes <= MAX_DATAFRAME_NODES:
+                # Matrices grandes: el formato se aplica al renderizar, sin construir todas las cadenas antes
+                dense_ybus = calculate_ybus_cached(int(n_nodes), branch_arrays).toarray()
+                column_config = {label: st.column_config.NumberColumn(format="%.5f") for label in labels}
+                tab_real, tab_imag = st.tabs(["Parte real", "Parte imaginaria"])
+                tab_real.dataframe(pd.DataFrame(dense_ybus.real, index=labels, columns=labels), column_config=column_config)
+                tab_imag.dataframe(pd.DataFrame(dense_ybus.imag, index=labels, columns=labels), column_config=column_config)
             else:
-                Ybus = calculate_ybus(int(n_nodes), branch_data)
-                st.write("La matriz Ybus calculada es:")
-                
-                formatted_matrix = [
-                    [format_complex(Ybus[i, j]) for j in range(Ybus.shape[1])] 
-                    for i in range(Ybus.shape[0])
-                ]
-                df_matrix = pd.DataFrame(
-                    formatted_matrix, 
-                    columns=[f"Nodo {i+1}" for i in range(n_nodes)], 
-                    index=[f"Nodo {i+1}" for i in range(n_nodes)]
-                )
-                st.table(df_matrix)
+                # Matrices muy grandes: no se densifica; solo se descargan los elementos no nulos
+                st.info(f"La matriz tiene más de {MAX_DATAFRAME_NODES} nodos; descargue sus elementos no nulos.")
+                st.download_button("Descargar Ybus (CSV)", ybus_entries_csv(int(n_nodes), branch_arrays, labels), file_name="ybus.csv", mime="text/csv")
 
 if __name__ == "__main__":
     main()
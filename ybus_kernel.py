@@ -0,0 +1,28 @@
+"""
+Kernel compilado con Numba para el ensamblaje de la Ybus.
+
+Vive en un módulo aparte porque Streamlit vuelve a ejecutar app.py completo en cada interacción;
+al importarse, el despachador compilado se conserva en sys.modules entre ejecuciones.
+"""
+import numpy as np
+from numba import njit
+
+@njit(cache=True, fastmath=True)
+def ybus_kernel(f, t, Y):
+    """ Genera las tripletas COO (filas, columnas, valores) de la parte serie de la Ybus. """
+    m = f.shape[0]
+    rows = np.empty(4 * m, np.int64)
+    cols = np.empty(4 * m, np.int64)
+    data = np.empty(4 * m, np.complex128)
+    k = 0
+    for b in range(m):
+        i = f[b] - 1  # Ajuste de índice para Python (0-indexado)
+        j = t[b] - 1
+        y = Y[b]
+
+        rows[k], cols[k], data[k] = i, i, y
+        rows[k + 1], cols[k + 1], data[k + 1] = j, j, y
+        rows[k + 2], cols[k + 2], data[k + 2] = i, j, -y
+        rows[k + 3], cols[k + 3], data[k + 3] = j, i, -y
+        k += 4
+    return rows[:k], cols[:k], data[:k]